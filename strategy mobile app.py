@@ -1,9 +1,10 @@
 import streamlit as st
-import yfinance as yf
+import numpy as np
 import pandas as pd
-from datetime import datetime
-import pytz
-import time
+from strategy_core import (
+    ASSETS, TICKERS, analyze, fetch_prices, get_est_time, get_refresh_slot,
+    get_session_date,
+)
 
 # ==============================================================================
 # STRATEGY DETAILS
@@ -40,79 +41,110 @@ STRATEGY_DOCS = """
     * **SCENARIO C (TOTAL APATHY / CHOP):** Stocks RED + Dollar DOWN + Gold DOWN -> ACTION: Buy CASH (SGOV)
 """
 
+LEGEND_MD = """
+* **DAILY CHECK (3:45 PM):** :red[**RED**] (Macro Unsafe) = VIX Inverted OR Credit Stress (Exit Immediately).
+* **FRIDAY CHECK (3:30 PM):**
+    * :green[**GREEN**] = Price > SMA + MACD Bullish (Positive Momentum).
+    * :orange[**YELLOW**] = Price > SMA but MACD Bearish (Weak Trend). Hold Position.
+    * :red[**RED (HEDGE)**] = Price < SMA (Check Defense: Hedge -> Gold Hedge -> Cash).
+* :red[**SAFETY**]: Always maintain 35% Trailing Stop GTC for Black Swans.
+"""
+
 # --- CONFIGURATION ---
 st.set_page_config(page_title="Roth Strategy", layout="centered")
 
-ASSETS = {
-    'TECH_3X': 'TQQQ', 'TECH_2X': 'QLD',
-    'SPY_3X':  'UPRO', 'SPY_2X':  'SSO',
-    'HEDGE':   '40% KMLM / 40% BTAL / 20% USDU',
-    'GOLD HEDGE':    '40% KMLM / 40% BTAL / 20% GLDM',
-    'CASH':    '100% SGOV (Treasury Bills)'
-}
-
-TICKERS = ['SPY', 'QQQ', 'HYG', 'IEI', 'USDU', 'GLDM', '^VIX', '^VIX3M']
+# Streamlit's default red/green/orange, for status cells in the data grid
+STATUS_COLORS = {'red': '#ff4b4b', 'green': '#21c354', 'orange': '#ffa421'}
 
 # --- HELPER FUNCTIONS ---
-def get_est_time():
-    """Returns current time in US/Eastern."""
-    utc_now = datetime.now(pytz.utc)
-    est = pytz.timezone('US/Eastern')
-    return utc_now.astimezone(est)
-
-def fetch_data_with_retry(tickers):
-    # Try fetching all at once first (fastest)
-    try:
-        # Use auto_adjust=False but grab 'Adj Close' to be safe
-        data = yf.download(tickers, period="2y", progress=False, auto_adjust=False)
-        
-        # Check if we got a MultiIndex (common with multiple tickers)
-        if isinstance(data.columns, pd.MultiIndex):
-            # STRICT CHECK: We MUST have 'Adj Close'
-            if 'Adj Close' in data.columns.levels[0]:
-                data = data['Adj Close']
-            else:
-                # If Adjusted Close is missing, we FAIL rather than guessing.
-                raise ValueError("Source data missing 'Adj Close'. Dividend adjustments unavailable.")
-        else:
-            # Single level columns
-            if 'Adj Close' in data:
-                data = data['Adj Close']
-            else:
-                # Only allow fallback for single tickers if absolutely necessary, 
-                # but better to rely on auto_adjust=True in the loop below if this fails.
-                data = data['Close'] 
-
-        # Verify we actually have data
-        if data.empty or data.shape[1] < len(tickers):
-            raise ValueError("Incomplete data returned")
-            
-        return data
-
-    except Exception as e:
-        print(f"Bulk download failed: {e}. Retrying individually...")
-        
-        # Fallback: Download one by one and combine (Slower but 99% reliable)
-        combined_data = {}
-        for t in tickers:
-            try:
-                # auto_adjust=True makes 'Close' = Adjusted Close automatically
-                df = yf.download(t, period="2y", progress=False, auto_adjust=True)
-                if not df.empty:
-                    combined_data[t] = df['Close'] # Because auto_adjust=True, 'Close' IS Adjusted
-                else:
-                    print(f"Failed to fetch {t}")
-            except Exception as e2:
-                print(f"Error fetching {t}: {e2}")
-        
-        if not combined_data:
-            return None
-            
-        return pd.DataFrame(combined_data)
+@st.cache_data(ttl=60, show_spinner=False)
+def get_time_caption():
+    # The header clock only shows minutes, so redraws reuse it for up to 60s
+    return f"Server Time: {get_est_time().strftime('%Y-%m-%d %I:%M %p EST')}"
+
+def get_time_suffix(est_now, macro_safe):
+    """Returns the execution-timing note appended to the signal headline."""
+    # 0 = Monday, 4 = Friday
+    today_weekday = est_now.weekday()
+
+    # Check if it's currently the Daily Macro Execution Time (3:45 PM EST)
+    # We give a window of 3:40 PM - 4:00 PM for the "Execute Now" logic
+    is_daily_close_window = (est_now.hour == 15 and est_now.minute >= 40)
+
+    if not macro_safe:
+        # PRIORITY 1: Macro Fire Alarm (Applies Every Day)
+        if is_daily_close_window:
+            return " (⚠️ EXECUTE NOW - MACRO PANIC)"
+        return " (ONLY Execute if Red at 3:45PM EST)"
+
+    if today_weekday != 4:
+        # PRIORITY 2: Not Friday (Wait)
+        return " (WAIT FOR FRIDAY)"
+
+    # PRIORITY 3: Friday (Execute)
+    return ""
+
+def render_metric_table(rows):
+    """Renders (label, value, color) rows as one table; color tints the value cell."""
+    table = pd.DataFrame([row[:2] for row in rows], columns=["Metric", "Value"])
+    value_css = [f"color: {STATUS_COLORS[color]}; font-weight: bold" if color else ""
+                 for _, _, color in rows]
+    styled = table.style.apply(lambda _: value_css, subset=["Value"])
+    st.dataframe(styled, hide_index=True)
+
+def render_data_grid(m):
+    """Renders the three-column metrics grid from analyze()'s metrics dict."""
+    # One table per column instead of a dozen st.metric/st.markdown
+    # elements, so the grid goes to the browser as three messages.
+    st.markdown("---")
+    col1, col2, col3 = st.columns(3)
+
+    # Col 1: Safety (VIX & Credit)
+    with col1:
+        st.subheader("1. Macro Safety")
+        render_metric_table([
+            ("VIX (Spot)", f"{m['vix_spot']:.2f}", None),
+            ("VIX (3M)", f"{m['vix_3m']:.2f}", None),
+            ("VIX Status", "PANIC (Inverted)", "red") if m['panic_active'] else ("VIX Status", "NORMAL", "green"),
+            ("HYG (Risk)", f"{m['hyg_ret']:.2%}", None),
+            ("IEI (Safe)", f"{m['iei_ret']:.2%}", None),
+            ("Credit Status", "STRESS (Risk Off)", "red") if m['credit_stress'] else ("Credit Status", "HEALTHY", "green"),
+        ])
+
+    # Col 2: Trend
+    with col2:
+        st.subheader("2. Trend & Mom.")
+
+        macd_txt = "MACD UP" if m['macd_bullish'] else "MACD DOWN"
+        trend_color = {"GREEN": "green", "RED": "red"}.get(m['trend_status'], "orange")
+        render_metric_table([
+            (f"Asset: {m['track_ticker']}", f"${m['track_price']:.2f}", None),
+            ("200 SMA", f"${m['sma_200']:.2f}", None),
+            ("Trend", f"{m['trend_status']} ({macd_txt})", trend_color),
+        ])
+
+    # Col 3: Defense
+    with col3:
+        st.subheader("3. Defense Select")
+        render_metric_table([
+            ("Dollar ($USDU)", f"${m['usdu_price']:.2f}", None),
+            ("Dollar Trend", "UP", "green") if m['USDU_trending_up'] else ("Dollar Trend", "DOWN", "red"),
+            ("Gold ($GLDM)", f"${m['gold_price']:.2f}", None),
+            ("Gold Trend", "UP", "green") if m['gold_trending_up'] else ("Gold Trend", "DOWN", "red"),
+        ])
+
+def render_legend():
+    """Renders the static rules legend from LEGEND_MD."""
+    st.markdown("---")
+    st.subheader("Strategy Rules & Legend")
+    st.info("EXECUTION: Fridays 3:30PM - 4:00PM EST. EXCEPT for Daily Macro 3:45PM - 4:00PM")
+
+    with st.expander("Show Detailed Legend", expanded=True):
+        st.markdown(LEGEND_MD)
 
 # --- MAIN UI ---
 st.title("ROTH STRATEGY: Friday 3:30PM")
-st.caption(f"Server Time: {get_est_time().strftime('%Y-%m-%d %I:%M %p EST')}")
+st.caption(get_time_caption())
 
 with st.expander("📄 Strategy Documentation (Click to Expand)"):
     st.markdown(STRATEGY_DOCS)
@@ -124,25 +156,31 @@ if st.button("RUN ANALYSIS", type="primary", use_container_width=True):
     status_placeholder.info("Fetching Market Data...")
 
     try:
-        # 1. Get Data
-        data = fetch_data_with_retry(TICKERS)
+        # One clock reading per click: the cache key, the freshness check and
+        # the timing note must all agree on what "now" is.
+        est_now = get_est_time()
+
+        # 1. Get Data (cached per trading day / intraday slot, see fetch_prices)
+        prices = fetch_prices(tuple(TICKERS), get_session_date(est_now), get_refresh_slot(est_now))
         
         # --- DATA INTEGRITY CHECK ---
-        if data is None or data.empty:
+        # Bad pulls are dropped from the cache so the next click re-downloads.
+        if prices is None:
+            fetch_prices.clear()
             status_placeholder.empty()
             st.error("Connection Failed: No data returned from API.")
             st.stop()
-            
-        # Handle MultiIndex (yfinance update standard)
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = data.columns.droplevel(0)
+
+        # arr: float32 closes (rows = days), columns named by `columns`
+        arr, columns, last_market_date = prices
+        cols = {t: i for i, t in enumerate(columns)}
 
         # Check for NaNs in the LAST row specifically (Today's Data)
-        last_row = data.iloc[-1]
-        nan_tickers = last_row[last_row.isna()].index.tolist()
+        nan_mask = np.isnan(arr[-1])
         
-        if nan_tickers:
-            missing_str = ", ".join(nan_tickers)
+        if nan_mask.any():
+            missing_str = ", ".join(t for t, is_nan in zip(columns, nan_mask) if is_nan)
+            fetch_prices.clear()
             st.error(f"CRITICAL DATA MISSING (NaN): {missing_str}\n\nMarket data may be delayed or unavailable. Please try again in 15 minutes.")
             st.stop()
             # --- HISTORY LENGTH CHECK (Prevent Silent Failures) ---
@@ -152,107 +190,35 @@ if st.button("RUN ANALYSIS", type="primary", use_container_width=True):
         short_history_tickers = []
         for t in ['SPY', 'QQQ', 'GLDM', 'USDU']:
             # Count valid non-NaN rows
-            valid_days = data[t].notna().sum()
+            valid_days = np.count_nonzero(~np.isnan(arr[:, cols[t]]))
             if valid_days < MIN_HISTORY:
                 short_history_tickers.append(f"{t} ({valid_days} days)")
         
         if short_history_tickers:
+            fetch_prices.clear()
             missing_str = ", ".join(short_history_tickers)
             st.error(f"⚠️ INSUFFICIENT DATA HISTORY:\n\n{missing_str}\n\nStrategy requires 205+ days for valid SMA/MACD.\nYahoo Finance returned incomplete data.")
             st.stop()
 
         # --- TIMESTAMP VALIDATION ---
         # 1. Get correct dates
-        last_market_date = data.index[-1].date()
-        est_now = get_est_time()
         current_est_date = est_now.date()
 
         # 2. Only check freshness on Weekdays (Mon-Fri)
         # (weekday 0=Mon, 4=Fri. So < 5 means it is a weekday)
         if current_est_date.weekday() < 5:
             if last_market_date != current_est_date:
+                fetch_prices.clear()
                 st.error(f"⚠️ DATA IS STALE! \n\nLast Market Date: {last_market_date}\nToday: {current_est_date}\n\nThe API has not returned today's price yet. Please wait.")
                 st.stop()
 
-        # 2. Extract Time Slices
-        cur = data.iloc[-1]       # Today
-        prev_20 = data.iloc[-21]  # 20 Trading Days ago
-        prev_63 = data.iloc[-63]  # 63 Trading Days ago
-
-        # --- CALCULATIONS ---
-
-        # A. Volatility Structure (Panic Check)
-        panic_active = cur['^VIX'] > cur['^VIX3M']
-
-        # B. Credit Stress (HYG vs IEI)
-        hyg_ret = (cur['HYG'] - prev_20['HYG']) / prev_20['HYG']
-        iei_ret = (cur['IEI'] - prev_20['IEI']) / prev_20['IEI']
-        credit_stress = hyg_ret < iei_ret
-
-        # MACRO SAFE SWITCH
-        macro_safe = not (panic_active or credit_stress)
-
-        # C. Trend & Asset Selection
-        tech_perf = (cur['QQQ'] - prev_63['QQQ']) / prev_63['QQQ']
-        spy_perf = (cur['SPY'] - prev_63['SPY']) / prev_63['SPY']
-        tech_leads = tech_perf > spy_perf
-
-        track_ticker = "QQQ" if tech_leads else "SPY"
-        track_price = cur[track_ticker]
-
-        # Moving Average
-        sma_200 = data[track_ticker].rolling(200).mean().iloc[-1]
-
-        # MACD Calculation
-        exp12 = data[track_ticker].ewm(span=12, adjust=False).mean()
-        exp26 = data[track_ticker].ewm(span=26, adjust=False).mean()
-        macd_line = exp12 - exp26
-        signal_line = macd_line.ewm(span=9, adjust=False).mean()
-        macd_bullish = macd_line.iloc[-1] > signal_line.iloc[-1]
-
-        # D. Defensive Trends
-        sma_USDU_63 = data['USDU'].rolling(63).mean().iloc[-1] 
-        sma_gold_200 = data['GLDM'].rolling(200).mean().iloc[-1] 
-        USDU_trending_up = cur['USDU'] > sma_USDU_63
-        gold_trending_up = cur['GLDM'] > sma_gold_200
-
-        # --- LOGIC ENGINE ---
-
-        # 1. Determine Trend Status
-        is_above_sma = track_price > sma_200
-        
-        if is_above_sma and macd_bullish:
-            trend_status = "GREEN"
-        elif not is_above_sma:
-            trend_status = "RED"
-        else:
-            trend_status = "YELLOW"
+        # 2. Compute Signals
+        res = analyze(arr, columns)
+        macro_safe = res['macro_safe']
+        trend_status = res['trend_status']
 
         # 2. Determine Time Warning Suffix
-        # 0 = Monday, 4 = Friday
-        est_now = get_est_time()
-        today_weekday = est_now.weekday()
-        
-        # Check if it's currently the Daily Macro Execution Time (3:45 PM EST)
-        # We give a window of 3:40 PM - 4:00 PM for the "Execute Now" logic
-        is_daily_close_window = (est_now.hour == 15 and est_now.minute >= 40)
-        
-        time_suffix = ""
-        
-        if not macro_safe:
-            # PRIORITY 1: Macro Fire Alarm (Applies Every Day)
-            if is_daily_close_window:
-                time_suffix = " (⚠️ EXECUTE NOW - MACRO PANIC)"
-            else:
-                time_suffix = " (ONLY Execute if Red at 3:45PM EST)"
-        
-        elif today_weekday != 4:
-            # PRIORITY 2: Not Friday (Wait)
-            time_suffix = " (WAIT FOR FRIDAY)"
-        
-        else:
-            # PRIORITY 3: Friday (Execute)
-            time_suffix = ""
+        time_suffix = get_time_suffix(est_now, macro_safe)
 
         # 3. Decision Matrix
         status_placeholder.empty()
@@ -260,11 +226,11 @@ if st.button("RUN ANALYSIS", type="primary", use_container_width=True):
         # --- RED LOGIC (Risk Off) ---
         if (not macro_safe) or (trend_status == "RED"):
             # Sub-Logic: Which defense?
-            if USDU_trending_up:
+            if res['USDU_trending_up']:
                 asset_name = "HEDGE"
                 asset_desc = ASSETS['HEDGE']
                 why = "Risk Off + Dollar Rising (Deflation Defense)."
-            elif gold_trending_up:
+            elif res['gold_trending_up']:
                 asset_name = "GOLD HEDGE"
                 asset_desc = ASSETS['GOLD HEDGE']
                 why = "Risk Off + Dollar Falling + Gold Up (Stagflation Defense)."
@@ -277,10 +243,9 @@ if st.button("RUN ANALYSIS", type="primary", use_container_width=True):
 
         # --- GREEN LOGIC (Risk On) ---
         elif trend_status == "GREEN":
-            target_idx = "TECH" if tech_leads else "SPY"
-            vix_spot = cur['^VIX']
+            target_idx = "TECH" if res['tech_leads'] else "SPY"
             
-            if vix_spot < 20:
+            if res['vix_spot'] < 20:
                 ticker = ASSETS[f'{target_idx}_3X']
                 lev = "3x"
             else:
@@ -299,81 +264,10 @@ if st.button("RUN ANALYSIS", type="primary", use_container_width=True):
             st.warning(f"### 🟡 YELLOW SIGNAL: HOLD{time_suffix}\n\n**HOLD CURRENT POSITION**\n\n*Price > SMA but MACD Bearish (Weak Momentum).*")
 
         # --- DATA GRID ---
-        st.markdown("---")
-        col1, col2, col3 = st.columns(3)
-
-        # Col 1: Safety (VIX & Credit)
-        with col1:
-            st.subheader("1. Macro Safety")
-            
-            # VIX
-            st.metric("VIX (Spot)", f"{cur['^VIX']:.2f}")
-            st.metric("VIX (3M)", f"{cur['^VIX3M']:.2f}")
-            
-            if panic_active:
-                st.markdown(":red[**STATUS: PANIC (Inverted)**]")
-            else:
-                st.markdown(":green[**STATUS: NORMAL**]")
-            
-            st.divider()
-            
-            # Credit
-            st.metric("HYG (Risk)", f"{hyg_ret:.2%}")
-            st.metric("IEI (Safe)", f"{iei_ret:.2%}")
-            
-            if credit_stress:
-                st.markdown(":red[**STATUS: STRESS (Risk Off)**]")
-            else:
-                st.markdown(":green[**STATUS: HEALTHY**]")
-
-        # Col 2: Trend
-        with col2:
-            st.subheader("2. Trend & Mom.")
-            
-            st.metric(f"Asset: {track_ticker}", f"${track_price:.2f}")
-            st.metric("200 SMA", f"${sma_200:.2f}")
-            
-            macd_txt = "MACD UP" if macd_bullish else "MACD DOWN"
-            
-            if trend_status == "GREEN":
-                st.markdown(f":green[**{trend_status} ({macd_txt})**]")
-            elif trend_status == "RED":
-                st.markdown(f":red[**{trend_status} ({macd_txt})**]")
-            else:
-                st.markdown(f":orange[**{trend_status} ({macd_txt})**]")
-
-        # Col 3: Defense
-        with col3:
-            st.subheader("3. Defense Select")
-            
-            # Dollar
-            USDU_stat_txt = "UP" if USDU_trending_up else "DOWN"
-            USDU_color = "green" if USDU_trending_up else "red"
-            st.metric("Dollar ($USDU)", f"${cur['USDU']:.2f}")
-            st.markdown(f":{USDU_color}[**TREND: {USDU_stat_txt}**]")
-            
-            st.divider()
-            
-            # Gold
-            GLDM_stat_txt = "UP" if gold_trending_up else "DOWN"
-            GLDM_color = "green" if gold_trending_up else "red"
-            st.metric("Gold ($GLDM)", f"${cur['GLDM']:.2f}")
-            st.markdown(f":{GLDM_color}[**TREND: {GLDM_stat_txt}**]")
+        render_data_grid(res)
 
     except Exception as e:
         st.error(f"Data Error: {e}")
         
 # --- LEGEND ---
-st.markdown("---")
-st.subheader("Strategy Rules & Legend")
-st.info("EXECUTION: Fridays 3:30PM - 4:00PM EST. EXCEPT for Daily Macro 3:45PM - 4:00PM")
-
-with st.expander("Show Detailed Legend", expanded=True):
-    st.markdown("""
-    * **DAILY CHECK (3:45 PM):** :red[**RED**] (Macro Unsafe) = VIX Inverted OR Credit Stress (Exit Immediately).
-    * **FRIDAY CHECK (3:30 PM):**
-        * :green[**GREEN**] = Price > SMA + MACD Bullish (Positive Momentum).
-        * :orange[**YELLOW**] = Price > SMA but MACD Bearish (Weak Trend). Hold Position.
-        * :red[**RED (HEDGE)**] = Price < SMA (Check Defense: Hedge -> Gold Hedge -> Cash).
-    * :red[**SAFETY**]: Always maintain 35% Trailing Stop GTC for Black Swans.
-    """)
+render_legend()
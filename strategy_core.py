@@ -0,0 +1,364 @@
+"""Market data fetching and signal math for the Roth strategy app."""
+import streamlit as st
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import time
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import MappingProxyType
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    # numba is optional: without it the kernels below run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+ASSETS = MappingProxyType({
+    'TECH_3X': 'TQQQ', 'TECH_2X': 'QLD',
+    'SPY_3X':  'UPRO', 'SPY_2X':  'SSO',
+    'HEDGE':   '40% KMLM / 40% BTAL / 20% USDU',
+    'GOLD HEDGE':    '40% KMLM / 40% BTAL / 20% GLDM',
+    'CASH':    '100% SGOV (Treasury Bills)'
+})
+
+TICKERS = ['SPY', 'QQQ', 'HYG', 'IEI', 'USDU', 'GLDM', '^VIX', '^VIX3M']
+
+EST = ZoneInfo('US/Eastern')
+
+# On-disk price cache (survives app restarts / container reloads)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_MAX_AGE_DAYS = 5
+
+# In-memory fetch_prices reuse: live prices are re-pulled every 15 min while
+# the market is open, settled ones are kept for the rest of the day.
+CACHE_TTL_INTRADAY = 15 * 60
+CACHE_TTL_EOD = 24 * 3600
+
+# 400 calendar days is ~275 trading rows in any year, so one download always
+# covers ANALYSIS_ROWS (200 SMA + MACD warm-up) with no second attempt.
+HISTORY_DAYS = 400
+HISTORY_PERIOD = f"{HISTORY_DAYS}d"
+
+# Seconds to wait on the parallel downloads before treating stragglers as missing
+DOWNLOAD_TIMEOUT = 10
+
+# Rows handed to the signal math: 200 SMA + history-check margin + MACD warm-up
+ANALYSIS_ROWS = 260
+
+# --- HELPER FUNCTIONS ---
+def get_est_time():
+    """Returns current time in US/Eastern."""
+    return datetime.now(tz=EST)
+
+def get_session_date(est_now):
+    """Returns the trading date for a US/Eastern time (weekends map to Friday)."""
+    session_date = est_now.date()
+    if session_date.weekday() >= 5:
+        session_date -= timedelta(days=session_date.weekday() - 4)
+    return session_date
+
+def is_session_closed(est_now):
+    """True once the day's closing prints are in (4:15 PM EST) or on weekends."""
+    return est_now.weekday() >= 5 or (est_now.hour, est_now.minute) >= (16, 15)
+
+def is_market_open(est_now):
+    """True on weekdays between the 9:30 AM open and the 4:15 PM settle."""
+    return est_now.weekday() < 5 and (9, 30) <= (est_now.hour, est_now.minute) < (16, 15)
+
+def get_refresh_slot(est_now):
+    """fetch_prices cache key part: changes every CACHE_TTL_INTRADAY while the market is open."""
+    # Outside market hours nothing moves until the next session, and the
+    # session date in the key already rolls over for that, so one slot does.
+    if is_market_open(est_now):
+        return int(est_now.timestamp() // CACHE_TTL_INTRADAY)
+    return None
+
+class FileCache:
+    """Parquet files under a directory, keyed by an md5 of the key, with an mtime TTL."""
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+
+    def path(self, key):
+        digest = hashlib.md5(str(key).encode()).hexdigest()[:12]
+        return os.path.join(self.directory, f"{self.prefix}_{digest}.parquet")
+
+    def get(self, key, ttl):
+        """Returns the cached DataFrame, or None if it is missing, expired or unreadable."""
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            return pd.read_parquet(path, engine="pyarrow")
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+
+    def set(self, key, data):
+        path = self.path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename so a concurrent reader never sees a half-written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            data.to_parquet(tmp_path, engine="pyarrow")
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not write cache file {path}: {e}")
+
+PRICE_CACHE = FileCache(CACHE_DIR, prefix="prices")
+
+def splice_prices(base, delta):
+    """Appends a short recent download onto the cached base. None if they don't line up."""
+    if delta is None or delta.empty or set(delta.columns) != set(base.columns):
+        return None
+
+    # The delta must overlap the base, or days are missing in between
+    overlap = base.index.intersection(delta.index)
+    if overlap.empty:
+        return None
+
+    # Adjusted closes get rewritten when a dividend goes ex, so if the shared
+    # days disagree the whole base is stale and must be downloaded again.
+    if not np.allclose(base.loc[overlap, delta.columns], delta.loc[overlap], rtol=1e-5, equal_nan=True):
+        return None
+
+    combined = pd.concat([base, delta[base.columns]])
+    combined = combined[~combined.index.duplicated(keep='last')].sort_index()
+    # Keep the same calendar window a fresh download would cover. Trimming to
+    # len(base) instead would shrink it a row a day, since intraday runs only
+    # persist the settled part of what they return.
+    return combined[combined.index > combined.index[-1] - pd.Timedelta(days=HISTORY_DAYS)]
+
+@st.cache_data(ttl=CACHE_TTL_EOD, max_entries=8, show_spinner=False)
+def fetch_prices(tickers, session_date, refresh_slot):
+    """Returns (closes, columns, last_date), or None. Cached per (tickers, session_date, refresh_slot)."""
+    # `tickers` must be a tuple so Streamlit can hash it. Keying on the session
+    # date makes the cache roll over by itself each trading day; refresh_slot
+    # (see get_refresh_slot) re-pulls live prices every 15 min intraday.
+    # st.cache_data hands every caller its own copy, so in-place edits are safe.
+    data = load_prices(tickers, session_date)
+    if data is None or data.empty:
+        return None
+
+    # Only the tail feeds the signals: keep it as a compact float32 matrix
+    # (rows = days, columns in `columns` order) rather than a full DataFrame.
+    tail = data.tail(ANALYSIS_ROWS)
+    return tail.to_numpy(np.float32), tuple(tail.columns), tail.index[-1].date()
+
+def load_prices(tickers, session_date):
+    """Returns the adjusted close DataFrame from the disk cache and/or Yahoo."""
+    # Keyed on the ticker set only: the base rolls forward day to day via the
+    # 5d splice below, so a per-date key would force a full download daily.
+    cache_key = sorted(tickers)
+    est_now = get_est_time()
+    # The base only ever holds settled days and is kept current by the 5d
+    # splice (whose overlap check catches dividend rewrites), so age alone is
+    # no reason to drop it; the limit is just what a 5d delta can bridge.
+    base = PRICE_CACHE.get(cache_key, ttl=CACHE_MAX_AGE_DAYS * 86400)
+
+    # Warm path: only the last few days go over the network
+    data = None
+    if base is not None:
+        data = splice_prices(base, download_prices(tickers, period="5d"))
+    if data is None:
+        base = None
+        data = download_prices(tickers, period=HISTORY_PERIOD)
+    if data is None or data.empty:
+        return data
+
+    # Only settled sessions are persisted: an intraday bar would otherwise be
+    # replayed in place of live prices during the 3:30 PM execution window.
+    if is_session_closed(est_now):
+        settled = data
+    else:
+        settled = data[data.index < pd.Timestamp(session_date)]
+    # A ticker that failed or timed out is an all-NaN column; persisting that
+    # would only get the base rejected (and re-downloaded) on the next click.
+    if (not settled.empty and not settled.isna().all().any()
+            and (base is None or settled.index[-1] > base.index[-1])):
+        PRICE_CACHE.set(cache_key, settled)
+    return data
+
+@st.cache_resource
+def get_session():
+    """Returns the HTTP session shared by every Yahoo call in this process."""
+    # One session means DNS + TLS setup is paid once, not per download or
+    # retry. curl_cffi (what yfinance uses internally) impersonates a browser;
+    # a plain requests.Session gets rate-limited by Yahoo.
+    from curl_cffi import requests as curl_requests
+    return curl_requests.Session(impersonate="chrome")
+
+@st.cache_resource
+def get_download_pool():
+    """Returns the worker threads shared by every download in this process."""
+    # curl_cffi keeps a curl handle (and its open connections) per thread,
+    # so the threads must outlive a single fetch for the session to pay off.
+    return ThreadPoolExecutor(max_workers=len(TICKERS))
+
+def download_ticker(ticker, period, session, attempts=2):
+    """Returns one ticker's adjusted closes, or None if every attempt failed."""
+    # Imported here, not at the top: yfinance adds ~200ms to the first page
+    # load, and only a RUN ANALYSIS click needs it (then it's in sys.modules)
+    import yfinance as yf
+
+    for attempt in range(1, attempts + 1):
+        try:
+            # auto_adjust=True makes 'Close' = Adjusted Close automatically
+            closes = yf.Ticker(ticker, session=session).history(period=period, auto_adjust=True)['Close']
+            if not closes.empty:
+                # Exchange-local timestamps -> plain dates, so every ticker
+                # (e.g. CBOE's ^VIX vs NYSE's SPY) lands on the same index
+                closes.index = closes.index.tz_localize(None)
+                return closes
+            print(f"Failed to fetch {ticker} (attempt {attempt})")
+        except Exception as e:
+            print(f"Error fetching {ticker} (attempt {attempt}): {e}")
+    return None
+
+def download_prices(tickers, period):
+    # One request per ticker, all in flight at once. The fetch is bound by
+    # network round-trips, so threads overlap them, and a slow or failing
+    # ticker retries without holding up the others. The cached session is
+    # looked up here, on the script thread, and handed to the workers.
+    session = get_session()
+    pool = get_download_pool()
+    futures = {t: pool.submit(download_ticker, t, period, session) for t in tickers}
+
+    # One hung ticker must not hold the page: stragglers are left to finish
+    # in the background and count as missing for this run.
+    wait(futures.values(), timeout=DOWNLOAD_TIMEOUT)
+    combined_data = {}
+    for t, future in futures.items():
+        if not future.done():
+            print(f"Timed out fetching {t} after {DOWNLOAD_TIMEOUT}s")
+        elif future.result() is not None:
+            combined_data[t] = future.result()
+    if not combined_data:
+        return None
+
+    # Tickers that never came back stay as all-NaN columns so the integrity
+    # checks name them instead of failing on a missing column.
+    return pd.DataFrame(combined_data, columns=list(tickers))
+
+def compute_signals(arr, idx):
+    """Returns every number the decision needs, from one pass over the closes."""
+    # Interpreted (no numba), the loop runs ~10x faster over Python floats
+    # than over NumPy scalars, so hand it nested lists in that case.
+    return signals_kernel(arr if HAVE_NUMBA else arr.tolist(), idx)
+
+@njit(cache=True)
+def signals_kernel(arr, idx):
+    # arr: float32 closes (rows = days), as an array or nested lists, hence
+    # the arr[i][j] indexing; idx: column positions of (SPY, QQQ, HYG, IEI,
+    # USDU, GLDM, ^VIX, ^VIX3M). `1.0 *` promotes each read to float64 first.
+    spy, qqq, hyg, iei, usdu, gldm, vix, vix3m = idx
+    n = len(arr)
+    last, prev_20, prev_63 = arr[n - 1], arr[n - 21], arr[n - 63]
+
+    # 20-day credit returns and 63-day index performance
+    hyg_ret = 1.0 * last[hyg] / prev_20[hyg] - 1.0
+    iei_ret = 1.0 * last[iei] / prev_20[iei] - 1.0
+    tech_perf = 1.0 * last[qqq] / prev_63[qqq] - 1.0
+    spy_perf = 1.0 * last[spy] / prev_63[spy] - 1.0
+    track = qqq if tech_perf > spy_perf else spy
+
+    # Trailing-window sums for the SMAs, plus the 12/26/9 MACD kept as
+    # running scalars, using the same recurrences as pandas
+    # ewm(span=..., adjust=False). NaN rows (x != x) are skipped by the MACD
+    # and poison an SMA window, as rolling() would.
+    # The EWMs forget their seed geometrically: after 6 * 26 rows the slow
+    # one keeps (25/27)^156 ~ 6e-6 of it, so older rows are not visited.
+    a12, a26, a9 = 2.0 / 13.0, 2.0 / 27.0, 2.0 / 10.0
+    e12 = e26 = macd = signal = np.nan
+    sum_track = sum_gold = sum_usdu = 0.0
+    ewm_start = max(0, n - 6 * 26)
+    for i in range(max(0, min(n - 200, ewm_start)), n):
+        x = 1.0 * arr[i][track]
+        if i >= n - 200:
+            sum_track += x
+            sum_gold += arr[i][gldm]
+        if i >= n - 63:
+            sum_usdu += arr[i][usdu]
+        if i < ewm_start or x != x:
+            continue
+        if e12 != e12:
+            e12 = e26 = x
+            signal = 0.0
+        else:
+            e12 = a12 * x + (1.0 - a12) * e12
+            e26 = a26 * x + (1.0 - a26) * e26
+        macd = e12 - e26
+        signal = a9 * macd + (1.0 - a9) * signal
+
+    return (sum_track / 200.0, sum_usdu / 63.0, sum_gold / 200.0, macd, signal,
+            hyg_ret, iei_ret, tech_perf, spy_perf, 1.0 * last[vix], 1.0 * last[vix3m])
+
+def analyze(arr, columns):
+    """Runs the strategy math on validated fetch_prices() output; returns the metrics dict."""
+    # The raw bytes of the float32 matrix are a cheap cache key
+    return analyze_closes(np.ascontiguousarray(arr).tobytes(), columns)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def analyze_closes(closes_bytes, columns):
+    """Memoized analyze(): the metrics are a pure function of the close matrix."""
+    cols = {t: i for i, t in enumerate(columns)}
+    arr = np.frombuffer(closes_bytes, dtype=np.float32).reshape(-1, len(columns))
+    cur = arr[-1]  # Today
+    (sma_200, sma_USDU_63, sma_gold_200, macd_line, signal_line,
+     hyg_ret, iei_ret, tech_perf, spy_perf, vix_spot, vix_3m) = compute_signals(
+        arr, tuple(cols[t] for t in TICKERS))
+
+    # --- CALCULATIONS ---
+
+    # A. Volatility Structure (Panic Check)
+    panic_active = vix_spot > vix_3m
+
+    # B. Credit Stress (HYG vs IEI)
+    credit_stress = hyg_ret < iei_ret
+
+    # MACRO SAFE SWITCH
+    macro_safe = not (panic_active or credit_stress)
+
+    # C. Trend & Asset Selection
+    tech_leads = tech_perf > spy_perf
+
+    track_ticker = "QQQ" if tech_leads else "SPY"
+    track_price = cur[cols[track_ticker]]
+
+    # MACD Momentum
+    macd_bullish = macd_line > signal_line
+
+    # D. Defensive Trends
+    USDU_trending_up = cur[cols['USDU']] > sma_USDU_63
+    gold_trending_up = cur[cols['GLDM']] > sma_gold_200
+
+    # --- LOGIC ENGINE ---
+
+    # 1. Determine Trend Status
+    is_above_sma = track_price > sma_200
+
+    if is_above_sma and macd_bullish:
+        trend_status = "GREEN"
+    elif not is_above_sma:
+        trend_status = "RED"
+    else:
+        trend_status = "YELLOW"
+
+    return {
+        'vix_spot': vix_spot, 'vix_3m': vix_3m, 'panic_active': panic_active,
+        'hyg_ret': hyg_ret, 'iei_ret': iei_ret, 'credit_stress': credit_stress,
+        'macro_safe': macro_safe, 'tech_leads': tech_leads,
+        'track_ticker': track_ticker, 'track_price': track_price, 'sma_200': sma_200,
+        'macd_bullish': macd_bullish, 'trend_status': trend_status,
+        'usdu_price': cur[cols['USDU']], 'USDU_trending_up': USDU_trending_up,
+        'gold_price': cur[cols['GLDM']], 'gold_trending_up': gold_trending_up,
+    }